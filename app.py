@@ -1,46 +1,157 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from pytrends.request import TrendReq
-import plotly.express as px
+from pytrends.exceptions import ResponseError
+import plotly.graph_objects as go
+import plotly.io as pio
 from datetime import date
 import pycountry
+import random
+import threading
+import time
 
 # --- Konfigurácia stránky ---
 st.set_page_config(page_title="Share of Search Analýza", layout="wide")
 
+# Grafy serializujeme do JSON cez rýchlejší orjson (je v requirements.txt)
+pio.json.config.default_engine = "orjson"
+
+# Dĺžka (v sekundách) časového okna, počas ktorého sa používajú rovnaké dáta z Google Trends
+TRENDS_CACHE_SECONDS = 6 * 3600
+
+# Počet pokusov a maximálne čakanie (v sekundách) pri chybách 429/503 z Google Trends
+FETCH_MAX_ATTEMPTS = 5
+FETCH_MAX_BACKOFF = 60
+RETRY_STATUS_CODES = (429, 503)
+
 # --- Funkcie na získanie zoznamov krajín a jazykov ---
-@st.cache_data
 def get_countries():
     """Vráti zoznam krajín s ich kódmi pre pytrends."""
-    countries = {}
-    for country in pycountry.countries:
-        countries[country.name] = country.alpha_2
-    return countries
+    return {country.name: country.alpha_2 for country in pycountry.countries}
 
-@st.cache_data
 def get_languages():
     """Vráti zoznam jazykov s ich kódmi pre pytrends."""
-    languages = {}
-    for lang in pycountry.languages:
-        if hasattr(lang, 'alpha_2'):
-            languages[lang.name] = f"{lang.alpha_2}-{lang.alpha_2.upper()}"
-    languages['Slovak'] = 'sk-SK'
-    languages['Czech'] = 'cs-CZ'
-    languages['English'] = 'en-US'
-    return dict(sorted(languages.items()))
+    pairs = [(lang.name, f"{lang.alpha_2}-{lang.alpha_2.upper()}") for lang in pycountry.languages if hasattr(lang, 'alpha_2')]
+    # Stabilné triedenie zachová poradie, takže tieto ručné kódy prepíšu tie z pycountry
+    pairs.extend([('Slovak', 'sk-SK'), ('Czech', 'cs-CZ'), ('English', 'en-US')])
+    return dict(sorted(pairs, key=lambda pair: pair[0]))
+
+@st.cache_resource
+def get_country_options(default="Slovakia"):
+    """Vráti n-ticu názvov krajín, slovník kódov a index predvolenej krajiny."""
+    codes = get_countries()
+    names = tuple(codes)
+    return names, codes, names.index(default)
+
+@st.cache_resource
+def get_language_options(default="Slovak"):
+    """Vráti n-ticu názvov jazykov, slovník kódov a index predvoleného jazyka."""
+    codes = get_languages()
+    names = tuple(codes)
+    return names, codes, names.index(default)
+
+# Zoznamy sa pripravia raz; cache_resource pri ďalších behoch skriptu vráti ten istý objekt bez kopírovania
+_COUNTRY_NAMES, _COUNTRY_CODES, _COUNTRY_DEFAULT_IDX = get_country_options()
+_LANGUAGE_NAMES, _LANGUAGE_CODES, _LANGUAGE_DEFAULT_IDX = get_language_options()
+
+def _retry_delay(error, attempt):
+    """Vráti čas čakania pred ďalším pokusom - podľa Retry-After, inak exponenciálne s jitterom."""
+    retry_after = error.response.headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+        return min(FETCH_MAX_BACKOFF, int(retry_after))
+    return min(FETCH_MAX_BACKOFF, 2 ** attempt) + random.random()
 
 # --- KĽÚČOVÁ ZMENA: Funkcia pre sťahovanie dát s CACHOVANÍM ---
 # Tento "dekorátor" hovorí Streamlitu, aby si pamätal výsledok tejto funkcie.
-# ttl="6h" znamená, že si bude výsledok pamätať maximálne 6 hodín, potom stiahne čerstvé dáta.
-@st.cache_data(ttl="6h")
-def fetch_trends_data(keywords, timeframe, country_code, lang_code):
+# persist="disk" zachová výsledky aj po reštarte aplikácie. Streamlit pri ňom ignoruje ttl,
+# preto je súčasťou kľúča cache aj číslo 6-hodinového okna (time_bucket) - v novom okne sa
+# stiahnu čerstvé dáta. Staré súbory na disku maže current_trends_window() pri prechode do nového okna.
+@st.cache_data(persist="disk", max_entries=128, show_spinner=False)
+def fetch_trends_data(keywords, timeframe, country_code, lang_code, time_bucket):
     """
-    Sťahuje dáta z Google Trends. Výsledky sú cachované.
+    Sťahuje dáta z Google Trends. Výsledky sú cachované (aj na disku).
+    time_bucket slúži len ako súčasť kľúča cache, aby dáta zastarali po TRENDS_CACHE_SECONDS.
     """
-    st.info("Sťahujem čerstvé dáta z Google Trends... Tento proces môže chvíľu trvať.")
     pytrends = TrendReq(hl=lang_code, tz=360, timeout=(10, 25))
-    pytrends.build_payload(kw_list=list(keywords), cat=0, timeframe=timeframe, geo=country_code, gprop='')
-    return pytrends.interest_over_time()
+    for attempt in range(FETCH_MAX_ATTEMPTS):
+        try:
+            pytrends.build_payload(kw_list=list(keywords), cat=0, timeframe=timeframe, geo=country_code, gprop='')
+            return pytrends.interest_over_time()
+        except ResponseError as e:
+            # Opakujeme len pri preťažení (HTTP 429/503); poslednú chybu pustíme ďalej, aby sa necachovala
+            if e.response.status_code not in RETRY_STATUS_CODES or attempt == FETCH_MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(_retry_delay(e, attempt))
+
+@st.cache_resource
+def _trends_window_state():
+    """Vráti zdieľaný záznam o poslednom časovom okne cache Google Trends."""
+    return {'window': None, 'lock': threading.Lock()}
+
+def current_trends_window():
+    """
+    Vráti číslo aktuálneho 6-hodinového okna pre kľúč cache fetch_trends_data.
+    Pri prechode do nového okna vymaže celú cache tejto funkcie vrátane súborov na disku,
+    aby disková cache nerástla donekonečna. Všetky záznamy tak zastarajú naraz, ale Streamlit
+    pri výpočte drží zámok na kľúč, takže rovnaký dopyt sa z Google stiahne len raz.
+    """
+    window = int(time.time() // TRENDS_CACHE_SECONDS)
+    state = _trends_window_state()
+    with state['lock']:
+        if state['window'] is not None and state['window'] != window:
+            fetch_trends_data.clear()
+        state['window'] = window
+    return window
+
+@st.cache_resource
+def _pie_template():
+    """Vráti základný donut graf, z ktorého sa kopírujú koláčové grafy porovnania rokov."""
+    return go.Figure(go.Pie(hole=0.4)).update_layout(showlegend=True)
+
+@st.cache_data
+def render_yoy_html(years, keywords, values):
+    """
+    Vráti HTML tabuľky ročného SoS a medziročných zmien. Výsledok je cachovaný.
+    Ročné hodnoty prichádzajú ako bajty float64 poľa, aby bol kľúč cache lacný na hashovanie.
+    """
+    sos_yearly = pd.DataFrame(
+        np.frombuffer(values, dtype=np.float64).reshape(len(years), len(keywords)),
+        index=list(years), columns=list(keywords)
+    )
+    yoy_change = sos_yearly.pct_change() * 100
+    # Stĺpce poskladáme naraz cez pd.concat namiesto postupného vkladania
+    pieces, keys = [], []
+    for year in sos_yearly.index:
+        pieces.append(sos_yearly.loc[year])
+        keys.append((year, 'SoS'))
+        if year in yoy_change.index:
+            pieces.append(yoy_change.loc[year])
+        else:
+            pieces.append(pd.Series(index=sos_yearly.columns, dtype=float))
+        keys.append((year, 'YoY'))
+    # Stĺpce (rok, typ) zoradíme cez MultiIndex - najnovší rok prvý, YoY pred SoS
+    display_df = pd.concat(pieces, axis=1, keys=keys, names=['year', 'kind'])
+    display_df = display_df.sort_index(axis=1, level=['year', 'kind'], ascending=[False, False])
+    display_df.columns = [f'{kind} {year}' for year, kind in display_df.columns]
+    sos_mask = display_df.columns.str.startswith('SoS')
+    yoy_mask = display_df.columns.str.startswith('YoY')
+    sos_subset = pd.IndexSlice[:, sos_mask]
+    yoy_subset = pd.IndexSlice[:, yoy_mask]
+    # axis=None s pevným rozsahom - farebná škála sa normalizuje raz pre celý blok, nie po stĺpcoch.
+    # Horná hranica SoS sa berie priamo z ročných dát, YoY má pevný rozsah -100 až 100 %
+    sos_vmax = float(sos_yearly.to_numpy().max())
+    # Riadky sú kľúčové slová od používateľa - HTML sa vkladá cez st.markdown, preto ich escapujeme
+    styler = (
+        display_df.style
+        .format_index(escape="html", axis=0)
+        .format_index(escape="html", axis=1)
+        .background_gradient(cmap='Greens', subset=sos_subset, axis=None, vmin=0, vmax=sos_vmax)
+        .background_gradient(cmap='RdYlGn', subset=yoy_subset, axis=None, vmin=-100, vmax=100)
+        .format("{:.2f}%", subset=yoy_subset, na_rep="-", escape="html")
+        .format("{:.2f}", subset=sos_subset, escape="html")
+    )
+    return styler.to_html()
 
 # --- Úvod aplikácie ---
 st.title("📊 Pokročilá Share of Search Analýza")
@@ -54,24 +165,26 @@ with st.sidebar:
         "Zadajte kľúčové slová (oddelené čiarkou)", 
         "Adidas, Nike, Reebok, Puma"
     )
-    keyword_list = [kw.strip() for kw in keywords_input.split(',') if kw.strip()]
+    # Normalizovaný tvar (malé písmená) -> tvar zadaný používateľom; duplicity sa zlúčia
+    keyword_display = {}
+    for kw in keywords_input.split(','):
+        if kw.strip():
+            keyword_display.setdefault(kw.strip().lower(), kw.strip())
+    keyword_list = list(keyword_display.values())
 
-    country_dict = get_countries()
-    lang_dict = get_languages()
-    
     selected_country_name = st.selectbox(
         "Zvoľte krajinu",
-        options=list(country_dict.keys()),
-        index=list(country_dict.keys()).index("Slovakia")
+        options=_COUNTRY_NAMES,
+        index=_COUNTRY_DEFAULT_IDX
     )
-    country_code = country_dict[selected_country_name]
+    country_code = _COUNTRY_CODES[selected_country_name]
 
     selected_lang_name = st.selectbox(
         "Zvoľte jazyk",
-        options=list(lang_dict.keys()),
-        index=list(lang_dict.keys()).index("Slovak")
+        options=_LANGUAGE_NAMES,
+        index=_LANGUAGE_DEFAULT_IDX
     )
-    lang_code = lang_dict[selected_lang_name]
+    lang_code = _LANGUAGE_CODES[selected_lang_name]
 
     st.markdown("### Časové obdobie")
     start_date = st.date_input("Dátum od", date(date.today().year - 5, 1, 1))
@@ -89,8 +202,12 @@ if run_button:
     else:
         try:
             # Volanie našej novej cachovanej funkcie
-            # Dôležité: keyword_list meníme na tuple(), lebo listy nie sú pre cache "hashable"
-            interest_over_time_df = fetch_trends_data(tuple(keyword_list), timeframe, country_code, lang_code)
+            # Dôležité: kľúčové slová posielame ako zoradený tuple() v malých písmenách - listy nie sú
+            # pre cache "hashable" a "Nike, Adidas" aj "adidas, nike" tak zdieľajú jeden záznam v cache
+            cache_keywords = tuple(sorted(keyword_display))
+            with st.spinner("Sťahujem dáta z Google Trends... Tento proces môže chvíľu trvať."):
+                interest_over_time_df = fetch_trends_data(cache_keywords, timeframe, country_code, lang_code, current_trends_window())
+            interest_over_time_df = interest_over_time_df.rename(columns=keyword_display)
 
             if interest_over_time_df.empty:
                 st.error("Nepodarilo sa získať žiadne dáta. Skontrolujte kľúčové slová alebo skúste iné časové obdobie.")
@@ -99,56 +216,70 @@ if run_button:
                 if 'isPartial' in interest_over_time_df.columns:
                     interest_over_time_df = interest_over_time_df.drop(columns=['isPartial'])
                 
-                interest_over_time_df['Total'] = interest_over_time_df.sum(axis=1)
-                sos_df = pd.DataFrame(index=interest_over_time_df.index)
-                for kw in keyword_list:
-                    sos_df[kw] = interest_over_time_df.apply(
-                        lambda row: (row[kw] / row['Total']) * 100 if row['Total'] > 0 else 0, axis=1
+                # Ak má nenulové hodnoty najviac jedno kľúčové slovo, SoS porovnanie nemá zmysel
+                nonzero_cols = (interest_over_time_df > 0).any(axis=0).sum()
+                if nonzero_cols <= 1:
+                    st.warning("Nenulové dáta má najviac jedno kľúčové slovo, porovnanie Share of Search preto nemá zmysel. Zobrazujem len surový záujem v čase.")
+                    st.line_chart(interest_over_time_df)
+                else:
+                    # Vektorizovaný výpočet SoS v NumPy (float32) - riadky s nulovým súčtom dostanú 0
+                    data = interest_over_time_df[list(keyword_list)].to_numpy(dtype=np.float32)
+                    totals = data.sum(axis=1, keepdims=True)
+                    sos = np.where(totals > 0, data / np.where(totals == 0, 1, totals) * 100.0, 0.0)
+                    sos_df = pd.DataFrame(sos, index=interest_over_time_df.index, columns=list(keyword_list))
+
+                    st.header("Porovnanie Share of Search: Aktuálny vs. Predošlý Rok")
+                    current_year = end_date.year
+                    previous_year = current_year - 1
+                    # Jedno zoskupenie časového radu: mesačné súčty a počty, z nich mesačné aj ročné priemery.
+                    # Ročný priemer počítame zo súčtov a počtov, aby mal každý riadok rovnakú váhu (nie každý mesiac)
+                    sos_grouped = sos_df.groupby([sos_df.index.year.rename('year'), sos_df.index.month.rename('month')])
+                    month_sums = sos_grouped.sum()
+                    month_counts = sos_grouped.count()
+                    sos_by_month = month_sums / month_counts
+                    sos_yearly = month_sums.groupby(level='year').sum() / month_counts.groupby(level='year').sum()
+                    sos_current_year = sos_yearly.loc[current_year] if current_year in sos_yearly.index else pd.Series(dtype=float)
+                    sos_previous_year = sos_yearly.loc[previous_year] if previous_year in sos_yearly.index else pd.Series(dtype=float)
+
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        if not sos_current_year.empty and sos_current_year.sum() > 0:
+                            fig_pie_current = go.Figure(_pie_template())
+                            fig_pie_current.data[0].update(labels=sos_current_year.index.to_numpy(), values=sos_current_year.to_numpy(dtype=np.float32))
+                            fig_pie_current.update_layout(title=f'Priemerný SoS za rok {current_year}')
+                            st.plotly_chart(fig_pie_current, use_container_width=True)
+                        else:
+                            st.info(f"Pre rok {current_year} nie sú k dispozícii žiadne dáta.")
+                    with col2:
+                        if not sos_previous_year.empty and sos_previous_year.sum() > 0:
+                            fig_pie_previous = go.Figure(_pie_template())
+                            fig_pie_previous.data[0].update(labels=sos_previous_year.index.to_numpy(), values=sos_previous_year.to_numpy(dtype=np.float32))
+                            fig_pie_previous.update_layout(title=f'Priemerný SoS za rok {previous_year}')
+                            st.plotly_chart(fig_pie_previous, use_container_width=True)
+                        else:
+                            st.info(f"Pre rok {previous_year} nie sú k dispozícii žiadne dáta.")
+
+                    st.header("Vývoj Share of Search v čase (Mesačne)")
+                    sos_monthly = sos_by_month.copy()
+                    sos_monthly.index = pd.to_datetime(pd.DataFrame({
+                        'year': sos_by_month.index.get_level_values('year'),
+                        'month': sos_by_month.index.get_level_values('month'),
+                        'day': 1,
+                    }))
+                    # Plotly dostáva priamo NumPy polia, ktoré serializuje ako binárne typed arrays
+                    months = sos_monthly.index.to_numpy()
+                    fig_bar = go.Figure()
+                    for col in sos_monthly.columns:
+                        fig_bar.add_trace(go.Bar(x=months, y=sos_monthly[col].to_numpy(dtype=np.float32), name=col))
+                    fig_bar.update_layout(barmode='relative', title=f'Mesačný vývoj SoS pre "{keywords_input}"', xaxis_title='Mesiac', yaxis_title='Share of Search (%)', legend_title='Kľúčové slovo', template='plotly_white')
+                    st.plotly_chart(fig_bar, use_container_width=True)
+
+                    st.header("Ročný vývoj a medziročné porovnanie (YoY)")
+                    st.markdown(
+                        render_yoy_html(tuple(sos_yearly.index.tolist()), tuple(sos_yearly.columns), sos_yearly.to_numpy(dtype=np.float64).tobytes()),
+                        unsafe_allow_html=True
                     )
-                sos_df.dropna(inplace=True)
-
-                st.header("Porovnanie Share of Search: Aktuálny vs. Predošlý Rok")
-                current_year = end_date.year
-                previous_year = current_year - 1
-                sos_current_year = sos_df[sos_df.index.year == current_year].mean()
-                sos_previous_year = sos_df[sos_df.index.year == previous_year].mean()
-
-                col1, col2 = st.columns(2)
-                with col1:
-                    if not sos_current_year.empty and sos_current_year.sum() > 0:
-                        fig_pie_current = px.pie(values=sos_current_year.values, names=sos_current_year.index, title=f'Priemerný SoS za rok {current_year}', hole=.4)
-                        st.plotly_chart(fig_pie_current, use_container_width=True)
-                    else:
-                        st.info(f"Pre rok {current_year} nie sú k dispozícii žiadne dáta.")
-                with col2:
-                    if not sos_previous_year.empty and sos_previous_year.sum() > 0:
-                        fig_pie_previous = px.pie(values=sos_previous_year.values, names=sos_previous_year.index, title=f'Priemerný SoS za rok {previous_year}', hole=.4)
-                        st.plotly_chart(fig_pie_previous, use_container_width=True)
-                    else:
-                        st.info(f"Pre rok {previous_year} nie sú k dispozícii žiadne dáta.")
-
-                st.header("Vývoj Share of Search v čase (Mesačne)")
-                sos_monthly = sos_df.resample('M').mean()
-                fig_bar = px.bar(sos_monthly, x=sos_monthly.index, y=sos_monthly.columns, title=f'Mesačný vývoj SoS pre "{keywords_input}"', labels={'value': 'Share of Search (%)', 'index': 'Mesiac', 'variable': 'Kľúčové slovo'}, template='plotly_white')
-                st.plotly_chart(fig_bar, use_container_width=True)
-
-                st.header("Ročný vývoj a medziročné porovnanie (YoY)")
-                sos_yearly = sos_df.resample('Y').mean()
-                sos_yearly.index = sos_yearly.index.year
-                yoy_change = sos_yearly.pct_change() * 100
-                display_df = pd.DataFrame()
-                for year in sos_yearly.index:
-                    display_df[f'SoS {year}'] = sos_yearly.loc[year]
-                    if year in yoy_change.index:
-                         display_df[f'YoY {year}'] = yoy_change.loc[year]
-                    else:
-                         display_df[f'YoY {year}'] = None
-                sorted_columns = sorted(display_df.columns, key=lambda x: (x.split(' ')[1], x.split(' ')[0]), reverse=True)
-                display_df = display_df[sorted_columns]
-                sos_cols = [col for col in display_df.columns if 'SoS' in col]
-                yoy_cols = [col for col in display_df.columns if 'YoY' in col]
-                st.dataframe(display_df.style.background_gradient(cmap='Greens', subset=sos_cols, vmin=0).background_gradient(cmap='RdYlGn', subset=yoy_cols, vmin=-100, vmax=100).format("{:.2f}%", subset=yoy_cols, na_rep="-").format("{:.2f}", subset=sos_cols))
-                st.caption("SoS = priemerný ročný Share of Search. YoY = medziročná percentuálna zmena oproti predošlému roku.")
+                    st.caption("SoS = priemerný ročný Share of Search. YoY = medziročná percentuálna zmena oproti predošlému roku.")
 
         except Exception as e:
             st.error(f"Vyskytla sa chyba: {e}")